@@ -1,97 +1,364 @@
+import glob
+import importlib.util
+import json
+import numpy as np
 import pandas as pd
 import os
+import re
 import time
 import torch
-from transformers import pipeline, T5ForConditionalGeneration, T5Tokenizer
+from functools import partial
+from multiprocessing import Pool
+from torch.utils.data import DataLoader
+from transformers import BitsAndBytesConfig, T5ForConditionalGeneration, T5Tokenizer
 from tqdm.auto import tqdm
-import gc
 import warnings
 warnings.filterwarnings("ignore")
 
-def preprocess_text_for_translation(text):
-    import re
+_PROTECT_RE = re.compile(r'(?P<TAG>\[[^\]]+\])|(?P<QUOTE>"[^"]+")|(?P<PLACEHOLDER>%\w+)')
+_RESTORE_RE = re.compile(r'__(TAG|QUOTE|PLACEHOLDER)_(\d+)__')
+_TOKEN_BUCKETS = (32, 64, 128, 256)
 
+def preprocess_text_for_translation(text):
     protected_tags = []
-    def protect_tag(match):
-        tag = match.group(0)
-        placeholder = f"__TAG_{len(protected_tags)}__"
-        protected_tags.append(tag)
-        return placeholder
-
     protected_quotes = []
-    def protect_quotes(match):
-        quote = match.group(0)
-        placeholder = f"__QUOTE_{len(protected_quotes)}__"
-        protected_quotes.append(quote)
-        return placeholder
-
     protected_placeholders = []
-    def protect_placeholder(match):
-        placeholder_text = match.group(0)
-        placeholder = f"__PLACEHOLDER_{len(protected_placeholders)}__"
-        protected_placeholders.append(placeholder_text)
+
+    protected = {
+        'TAG': protected_tags,
+        'QUOTE': protected_quotes,
+        'PLACEHOLDER': protected_placeholders,
+    }
+
+    def protect(match):
+        kind = match.lastgroup
+        items = protected[kind]
+        placeholder = f"__{kind}_{len(items)}__"
+        items.append(match.group(0))
         return placeholder
 
-    text = re.sub(r'\[([^\]]+)\]', protect_tag, text)
-    text = re.sub(r'"([^"]+)"', protect_quotes, text)
-    text = re.sub(r'%\w+', protect_placeholder, text)
+    text = _PROTECT_RE.sub(protect, text)
 
     return text, protected_tags, protected_quotes, protected_placeholders
 
 def postprocess_translated_text(text, protected_tags, protected_quotes, protected_placeholders):
-    for i, tag in enumerate(protected_tags):
-        text = text.replace(f"__TAG_{i}__", tag)
+    protected = {
+        'TAG': protected_tags,
+        'QUOTE': protected_quotes,
+        'PLACEHOLDER': protected_placeholders,
+    }
+
+    def restore(match):
+        items = protected[match.group(1)]
+        i = int(match.group(2))
+        return items[i] if i < len(items) else match.group(0)
+
+    return _RESTORE_RE.sub(restore, text)
+
+def blank_text_mask(texts):
+    if texts.dtype.kind in 'biufc':
+        return texts.isna()
+
+    try:
+        blank_strings = texts.str.fullmatch(r'\s*', na=False)
+    except AttributeError:
+        return texts.isna()
+
+    return texts.isna() | blank_strings
+
+def collate_input_ids(batch_input_ids, tokenizer, pad_to_bucket=False):
+    if not pad_to_bucket:
+        return dict(tokenizer.pad({'input_ids': batch_input_ids}, padding=True, return_tensors='pt'))
+
+    longest = max(len(input_ids) for input_ids in batch_input_ids)
+    bucket_len = next((bucket for bucket in _TOKEN_BUCKETS if bucket >= longest), longest)
+
+    return dict(tokenizer.pad(
+        {'input_ids': batch_input_ids},
+        padding='max_length',
+        max_length=bucket_len,
+        return_tensors='pt'
+    ))
+
+def cuda_compute_dtype():
+    if torch.cuda.get_device_capability()[0] >= 8:
+        return torch.bfloat16
+
+    return torch.float16
+
+def generate_translations(model, tokenizer, batch_inputs, device, cache_implementation=None):
+    inputs = {key: value.to(device, non_blocking=True) for key, value in batch_inputs.items()}
+
+    autocast_dtype = cuda_compute_dtype() if device.type == "cuda" else model.dtype
+
+    with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=autocast_dtype, enabled=(device.type == "cuda")):
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=256,
+            num_beams=1,
+            do_sample=False,
+            use_cache=True,
+            cache_implementation=cache_implementation
+        )
+
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+def load_ct2_translator(model_name, device):
+    try:
+        import ctranslate2
+    except ImportError:
+        return None
+
+    model_dir = f"{model_name.split('/')[-1]}-ct2"
+    compute_type = "int8_float16" if device.type == "cuda" else "int8"
+
+    try:
+        if not os.path.isdir(model_dir):
+            print(f"Converting {model_name} to CTranslate2 format in {model_dir}...")
+            ctranslate2.converters.TransformersConverter(model_name).convert(f"{model_dir}.tmp", quantization=compute_type, force=True)
+            os.replace(f"{model_dir}.tmp", model_dir)
+
+        return ctranslate2.Translator(model_dir, device=device.type, compute_type=compute_type)
+    except Exception as e:
+        print(f"CTranslate2 unavailable: {str(e)[:100]}... Falling back to transformers.")
+        return None
+
+def generate_translations_ct2(translator, tokenizer, batch_input_ids):
+    source_tokens = [tokenizer.convert_ids_to_tokens(input_ids) for input_ids in batch_input_ids]
+
+    results = translator.translate_batch(
+        source_tokens,
+        max_batch_size=len(source_tokens),
+        beam_size=1,
+        max_decoding_length=256
+    )
+
+    return [
+        tokenizer.decode(tokenizer.convert_tokens_to_ids(result.hypotheses[0]), skip_special_tokens=True)
+        for result in results
+    ]
+
+def load_translation_backend(model_name, tokenizer, device, batch_size):
+    translator = load_ct2_translator(model_name, device)
+    quantized = translator is not None
+
+    if translator is not None:
+        print("Using CTranslate2 backend.")
+        return None, list, partial(generate_translations_ct2, translator, tokenizer), quantized, False
+
+    compiled = False
+
+    if device.type == "cuda":
+        torch.backends.cuda.matmul.allow_tf32 = True
+
+        if importlib.util.find_spec("bitsandbytes") is not None:
+            quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            quantization_config = None
+        quantized = quantization_config is not None
 
-    for i, quote in enumerate(protected_quotes):
-        text = text.replace(f"__QUOTE_{i}__", quote)
+        model = T5ForConditionalGeneration.from_pretrained(
+            model_name,
+            torch_dtype=cuda_compute_dtype(),
+            low_cpu_mem_usage=True,
+            device_map={"": torch.cuda.current_device()} if quantized else None,
+            quantization_config=quantization_config
+        )
+        if not quantized:
+            model = model.to(device)
+        model.eval()
+
+        if quantized:
+            print("Model loaded with 8-bit weights.")
+
+        try:
+            model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+            warmup_input_ids = tokenizer("translate English to Portuguese: " + "warm up " * 256, truncation=True, max_length=256)['input_ids']
+
+            for bucket_len in _TOKEN_BUCKETS:
+                warmup_batch_size = batch_size or optimize_batch_size(bucket_len, quantized=quantized)
+                warmup_inputs = collate_input_ids([warmup_input_ids[:bucket_len]] * warmup_batch_size, tokenizer, pad_to_bucket=True)
+                generate_translations(model, tokenizer, warmup_inputs, device, cache_implementation="static")
+
+            compiled = True
+            print("Model compiled with torch.compile.")
+        except Exception as e:
+            print(f"torch.compile failed: {str(e)[:100]}... Falling back to eager mode.")
+            vars(model).pop('forward', None)
+    else:
+        model = T5ForConditionalGeneration.from_pretrained(
+            model_name,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True
+        ).to(device)
+        model.eval()
+
+    if compiled:
+        collate_fn = partial(collate_input_ids, tokenizer=tokenizer, pad_to_bucket=True)
+        translate_batch = partial(generate_translations, model, tokenizer, device=device, cache_implementation="static")
+    else:
+        collate_fn = partial(collate_input_ids, tokenizer=tokenizer)
+        translate_batch = partial(generate_translations, model, tokenizer, device=device)
+
+    return model, collate_fn, translate_batch, quantized, compiled
+
+def read_csv_fast(csv_path, usecols=None, use_pyarrow=False):
+    if use_pyarrow:
+        try:
+            import pyarrow.csv as pa_csv
+        except ImportError:
+            use_pyarrow = False
+
+    if not use_pyarrow:
+        return pd.read_csv(csv_path, usecols=usecols)
+
+    table = pa_csv.read_csv(
+        csv_path,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(include_columns=usecols) if usecols else None
+    )
+
+    return table.to_pandas()
+
+def find_checkpoint_parts_on_disk(output_csv_path):
+    part_paths = glob.glob(f"{glob.escape(output_csv_path)}.part*.*")
+    part_indices = [re.match(r'\.part(\d+)\.(parquet|csv)$', part_path[len(output_csv_path):]) for part_path in part_paths]
+
+    return [
+        part_path for _, part_path in sorted(
+            (int(match.group(1)), part_path) for match, part_path in zip(part_indices, part_paths) if match
+        )
+    ]
 
-    for i, placeholder in enumerate(protected_placeholders):
-        text = text.replace(f"__PLACEHOLDER_{i}__", placeholder)
+def load_checkpoint_parts(output_csv_path):
+    progress_path = f"{output_csv_path}.progress.json"
 
-    return text
+    if not os.path.exists(progress_path):
+        return []
 
-def translate_csv_batched(input_csv_path, output_csv_path, batch_size=32):
+    try:
+        with open(progress_path) as f:
+            checkpoint_parts = json.load(f)['parts']
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Unreadable checkpoint file {progress_path}: {e}. Looking for checkpoint parts on disk...")
+        return find_checkpoint_parts_on_disk(output_csv_path)
+
+    missing_parts = [part_path for part_path in checkpoint_parts if not os.path.exists(part_path)]
+    if missing_parts:
+        print(f"Skipping {len(missing_parts)} missing checkpoint part(s).")
+
+    return [part_path for part_path in checkpoint_parts if os.path.exists(part_path)]
+
+def read_checkpoint_part(part_path, use_pyarrow=False):
+    if part_path.endswith('.parquet'):
+        return pd.read_parquet(part_path)
+
+    return read_csv_fast(part_path, use_pyarrow=use_pyarrow)
+
+def save_checkpoint_part(df, translations, positions, output_csv_path, checkpoint_parts):
+    part_format = "parquet" if importlib.util.find_spec("pyarrow") is not None else "csv"
+
+    part_index = len(checkpoint_parts)
+    while os.path.exists(f"{output_csv_path}.part{part_index}.{part_format}"):
+        part_index += 1
+    part_path = f"{output_csv_path}.part{part_index}.{part_format}"
+
+    part_df = df.iloc[positions][['unique_id', 'original_text']].copy()
+    part_df['translated_text'] = translations[positions]
+
+    if part_format == "parquet":
+        part_df.to_parquet(part_path, index=False)
+    else:
+        part_df.to_csv(part_path, index=False)
+
+    checkpoint_parts.append(part_path)
+
+    progress_path = f"{output_csv_path}.progress.json"
+    with open(f"{progress_path}.tmp", 'w') as f:
+        json.dump({'parts': checkpoint_parts}, f)
+    os.replace(f"{progress_path}.tmp", progress_path)
+
+def clear_checkpoint_parts(output_csv_path):
+    for part_path in find_checkpoint_parts_on_disk(output_csv_path):
+        os.remove(part_path)
+
+    progress_path = f"{output_csv_path}.progress.json"
+    for path in (progress_path, f"{progress_path}.tmp"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def translate_csv_batched(input_csv_path, output_csv_path, batch_size=None, use_pyarrow=False):
     print(f"Loading file: {input_csv_path}")
-    input_df = pd.read_csv(input_csv_path)
+    df = read_csv_fast(input_csv_path, use_pyarrow=use_pyarrow)
 
-    if 'translated_text' not in input_df.columns:
-        input_df['translated_text'] = ''
+    if 'translated_text' not in df.columns:
+        df['translated_text'] = ''
 
-    df = input_df.copy()
-    df['translated_text'] = df['translated_text'].astype('object')
+    checkpoint_parts = load_checkpoint_parts(output_csv_path)
 
-    if os.path.exists(output_csv_path):
-        print(f"Existing output file found: {output_csv_path}. Attempting to resume translation...")
+    if os.path.exists(output_csv_path) or checkpoint_parts:
+        print(f"Existing output found for {output_csv_path}. Attempting to resume translation...")
         try:
-            existing_output_df = pd.read_csv(output_csv_path)
+            existing_frames = []
+            if os.path.exists(output_csv_path):
+                existing_frames.append(read_csv_fast(
+                    output_csv_path,
+                    usecols=['unique_id', 'original_text', 'translated_text'],
+                    use_pyarrow=use_pyarrow
+                ))
+            for part_path in checkpoint_parts:
+                try:
+                    existing_frames.append(read_checkpoint_part(part_path, use_pyarrow=use_pyarrow))
+                except Exception as e:
+                    print(f"Skipping unreadable checkpoint part {part_path}: {e}")
+
+            existing_output_df = pd.concat(existing_frames, ignore_index=True)
 
-            existing_translations_map = {}
-            for _, row in existing_output_df.iterrows():
-                key = (row['unique_id'], row['original_text'])
-                if pd.notna(row['translated_text']) and str(row['translated_text']).strip() != "":
-                    existing_translations_map[key] = row['translated_text']
+            existing_output_df = existing_output_df[
+                ~blank_text_mask(existing_output_df['translated_text'])
+            ].drop_duplicates(subset=['unique_id', 'original_text'], keep='last')
 
-            for idx, row in df.iterrows():
-                key = (row['unique_id'], row['original_text'])
-                if key in existing_translations_map:
-                    df.at[idx, 'translated_text'] = existing_translations_map[key]
+            df = df.merge(
+                existing_output_df,
+                on=['unique_id', 'original_text'],
+                how='left',
+                suffixes=('_new', '')
+            )
+            df['translated_text'] = df['translated_text'].astype('object').fillna(df.pop('translated_text_new'))
 
             print("Existing translations loaded and merged.")
 
         except Exception as e:
             print(f"Error loading existing file: {e}. Starting a new translation...")
-            df['translated_text'] = df['translated_text'].astype('object')
     else:
         print(f"Output file {output_csv_path} not found. Starting a new translation...")
 
-    needs_translation_mask = df['translated_text'].isna() | (df['translated_text'].astype(str).str.strip() == "")
+    needs_translation_mask = blank_text_mask(df['translated_text'])
     indices_to_translate = df.index[needs_translation_mask].tolist()
 
     if not indices_to_translate:
         print("No new text to translate. The file is already fully translated.")
         df.to_csv(output_csv_path, index=False)
+        clear_checkpoint_parts(output_csv_path)
         return
 
+    translations = df['translated_text'].to_numpy(dtype=object, copy=True)
+
+    original_texts = df.loc[indices_to_translate, 'original_text']
+    stripped_texts = original_texts.fillna('').astype(str).str.strip()
+    valid_mask = stripped_texts != ""
+
+    empty_indices = stripped_texts.index[~valid_mask]
+    if len(empty_indices) > 0:
+        translations[df.index.get_indexer(empty_indices)] = ""
+
+    valid_texts = stripped_texts[valid_mask]
+    valid_positions = df.index.get_indexer(valid_texts.index)
+
+    text_codes, unique_texts = pd.factorize(valid_texts)
+    text_counts = np.bincount(text_codes, minlength=len(unique_texts))
+    unique_translations = np.empty(len(unique_texts), dtype=object)
+
     print("Initializing optimized translation model...")
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -101,30 +368,12 @@ def translate_csv_batched(input_csv_path, output_csv_path, batch_size=32):
 
     tokenizer = T5Tokenizer.from_pretrained(model_name, legacy=False)
 
-    if device.type == "cuda":
-        model = T5ForConditionalGeneration.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16,
-            device_map="auto"
-        )
+    with Pool(processes=max(1, (os.cpu_count() or 1) - 1)) as preprocess_pool:
+        preprocess_result = preprocess_pool.map_async(preprocess_text_for_translation, unique_texts.tolist(), chunksize=256)
 
-        translator_pipeline = pipeline(
-            "text2text-generation",
-            model=model,
-            tokenizer=tokenizer
-        )
-    else:
-        model = T5ForConditionalGeneration.from_pretrained(
-            model_name,
-            torch_dtype=torch.float32
-        )
+        model, collate_fn, translate_batch, quantized, compiled = load_translation_backend(model_name, tokenizer, device, batch_size)
 
-        translator_pipeline = pipeline(
-            "text2text-generation",
-            model=model,
-            tokenizer=tokenizer,
-            device=device
-        )
+        protected_rows = preprocess_result.get()
 
     print("Translation model initialized with optimizations.")
 
@@ -134,99 +383,111 @@ def translate_csv_batched(input_csv_path, output_csv_path, batch_size=32):
     print(f"Total lines in file: {total_lines_in_file}")
     print(f"Lines already translated: {lines_already_translated}")
     print(f"Lines to translate in this session: {len(indices_to_translate)}")
-    print(f"Batch size: {batch_size}")
+    print(f"Batch size: {batch_size or 'adaptive per token length'}")
+    print(f"Unique texts to translate: {len(unique_texts)}")
 
-    save_frequency = max(1, len(indices_to_translate) // 20)
+    protected_df = pd.DataFrame(
+        protected_rows,
+        columns=['processed_text', 'tags', 'quotes', 'placeholders']
+    )
 
-    start_time = time.time()
+    prefix_ids = tokenizer("translate English to Portuguese:", add_special_tokens=False)['input_ids']
+    processed_texts = protected_df['processed_text'].tolist()
+    body_inputs = tokenizer(processed_texts, truncation=True, max_length=256 - len(prefix_ids))['input_ids'] if processed_texts else []
+    tokenized_inputs = [prefix_ids + body_ids for body_ids in body_inputs]
 
-    with tqdm(total=total_lines_in_file, initial=lines_already_translated, unit="lines", desc="Translation Progress") as pbar:
-        for i in range(0, len(indices_to_translate), batch_size):
-            batch_start_time = time.time()
+    lengths = np.array([len(input_ids) for input_ids in tokenized_inputs])
+    order = np.argsort(lengths, kind='stable')
 
-            batch_current_indices = indices_to_translate[i:i + batch_size]
-            batch_original_texts = df.loc[batch_current_indices, 'original_text'].tolist()
+    sorted_lengths = lengths[order]
+    batches = []
+    bucket_start = 0
 
-            valid_texts = []
-            valid_indices = []
+    for bucket_len in _TOKEN_BUCKETS:
+        bucket_stop = len(order) if bucket_len == _TOKEN_BUCKETS[-1] else int(np.searchsorted(sorted_lengths, bucket_len, side='right'))
+        bucket_batch_size = batch_size or optimize_batch_size(bucket_len, quantized=quantized)
 
-            for idx, text in zip(batch_current_indices, batch_original_texts):
-                if pd.notna(text) and str(text).strip() != "":
-                    valid_texts.append(str(text).strip())
-                    valid_indices.append(idx)
-                else:
-                    df.at[idx, 'translated_text'] = ""
+        if bucket_stop > bucket_start:
+            print(f"Texts up to {bucket_len} tokens: {bucket_stop - bucket_start} (batch size {bucket_batch_size})")
 
-            if valid_texts:
-                preprocessed_data = []
-                for text in valid_texts:
-                    processed_text, tags, quotes, placeholders = preprocess_text_for_translation(text)
-                    preprocessed_data.append((processed_text, tags, quotes, placeholders))
+        batches.extend(order[j:min(j + bucket_batch_size, bucket_stop)] for j in range(bucket_start, bucket_stop, bucket_batch_size))
+        bucket_start = bucket_stop
 
-                prefixed_texts = ["translate English to Portuguese: " + data[0] for data in preprocessed_data]
+    save_frequency = max(1, len(batches) // 20)
 
-                try:
-                    batch_results = translator_pipeline(
-                        prefixed_texts,
-                        max_new_tokens=256,
-                        num_beams=1,
-                        do_sample=False,
-                        batch_size=len(prefixed_texts)
-                    )
-
-                    if isinstance(batch_results, list):
-                        translated_texts = [res['generated_text'] if isinstance(res, dict) else str(res) for res in batch_results]
-                    else:
-                        translated_texts = [str(batch_results)]
-
-                    for idx, translated_text, (_, tags, quotes, placeholders) in zip(valid_indices, translated_texts, preprocessed_data):
-                        final_text = postprocess_translated_text(translated_text.strip(), tags, quotes, placeholders)
-                        df.at[idx, 'translated_text'] = final_text
+    input_loader = DataLoader(
+        tokenized_inputs,
+        batch_sampler=batches,
+        collate_fn=collate_fn,
+        num_workers=0 if model is None else 2,
+        pin_memory=(model is not None and device.type == "cuda")
+    )
 
-                except Exception as e:
-                    print(f"\nError translating batch {i//batch_size + 1}: {str(e)[:100]}...")
-                    for idx, prefixed_text, (_, tags, quotes, placeholders) in zip(valid_indices, prefixed_texts, preprocessed_data):
-                        try:
-                            individual_result = translator_pipeline(
-                                prefixed_text,
-                                max_new_tokens=256,
-                                num_beams=1,
-                                do_sample=False
-                            )
-
-                            if isinstance(individual_result, list) and len(individual_result) > 0:
-                                translated = individual_result[0]['generated_text'] if isinstance(individual_result[0], dict) else str(individual_result[0])
-                            else:
-                                translated = str(individual_result)
-
-                            final_text = postprocess_translated_text(translated.strip(), tags, quotes, placeholders)
-                            df.at[idx, 'translated_text'] = final_text
-                        except:
-                            df.at[idx, 'translated_text'] = "[TRANSLATION ERROR]"
-
-            pbar.update(len(batch_current_indices))
-
-            batch_time = time.time() - batch_start_time
-            texts_per_second = len(batch_current_indices) / batch_time if batch_time > 0 else 0
-
-            if i % (batch_size * 5) == 0:
-                elapsed_time = time.time() - start_time
-                remaining_batches = (len(indices_to_translate) - i - batch_size) // batch_size
-                eta = (elapsed_time / ((i // batch_size) + 1)) * remaining_batches if i > 0 else 0
-
-                pbar.set_postfix({
-                    'Texts/s': f'{texts_per_second:.1f}',
-                    'ETA': f'{eta/60:.1f}min'
-                })
-
-            if i % (save_frequency * batch_size) == 0:
-                df.to_csv(output_csv_path, index=False)
-
-                if device.type == "cuda":
+    saved_until = 0
+    processed_until = 0
+
+    start_time = time.time()
+
+    with tqdm(
+        total=total_lines_in_file,
+        initial=lines_already_translated,
+        unit="lines",
+        desc="Translation Progress",
+        bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]"
+    ) as pbar:
+        pbar.update(len(empty_indices))
+
+        for batch_number, (batch_order, batch_inputs) in enumerate(zip(batches, input_loader)):
+            batch_input_ids = [tokenized_inputs[j] for j in batch_order]
+            batch_protected = protected_df.iloc[batch_order]
+            batch_protected_items = list(zip(batch_protected['tags'], batch_protected['quotes'], batch_protected['placeholders']))
+
+            try:
+                translated_texts = translate_batch(batch_inputs)
+
+                final_texts = [
+                    postprocess_translated_text(translated_text.strip(), tags, quotes, placeholders)
+                    for translated_text, (tags, quotes, placeholders) in zip(translated_texts, batch_protected_items)
+                ]
+
+            except Exception as e:
+                print(f"\nError translating batch {batch_number + 1}: {str(e)[:100]}...")
+
+                if compiled:
+                    print("Disabling torch.compile and retrying in eager mode.")
+                    vars(model).pop('forward', None)
+                    translate_batch = partial(generate_translations, model, tokenizer, device=device)
+                    compiled = False
+
+                final_texts = []
+                for input_ids, (tags, quotes, placeholders) in zip(batch_input_ids, batch_protected_items):
+                    try:
+                        translated = translate_batch(collate_fn([input_ids]))[0]
+                        final_texts.append(postprocess_translated_text(translated.strip(), tags, quotes, placeholders))
+                    except:
+                        final_texts.append("[TRANSLATION ERROR]")
+
+            unique_translations[batch_order] = final_texts
+            batch_line_count = int(text_counts[batch_order].sum())
+
+            pbar.update(batch_line_count)
+
+            processed_until += len(batch_order)
+
+            if batch_number % save_frequency == 0:
+                saved_mask = np.isin(text_codes, order[saved_until:processed_until])
+                saved_positions = valid_positions[saved_mask]
+                translations[saved_positions] = unique_translations[text_codes[saved_mask]]
+                save_checkpoint_part(df, translations, saved_positions, output_csv_path, checkpoint_parts)
+                saved_until = processed_until
+
+                if device.type == "cuda" and torch.cuda.memory_reserved() > 0.9 * torch.cuda.get_device_properties(device).total_memory:
                     torch.cuda.empty_cache()
-                gc.collect()
 
+    translations[valid_positions] = unique_translations[text_codes]
+    df['translated_text'] = translations
     df.to_csv(output_csv_path, index=False)
+    clear_checkpoint_parts(output_csv_path)
 
     total_time = time.time() - start_time
     total_translated = len(indices_to_translate)
@@ -237,28 +498,32 @@ def translate_csv_batched(input_csv_path, output_csv_path, batch_size=32):
     print(f"Average speed: {avg_speed:.1f} texts/second")
     print(f"File saved to: {output_csv_path}")
 
-def optimize_batch_size():
+def optimize_batch_size(seq_len=256, quantized=False):
     if not torch.cuda.is_available():
         return 16
 
     gpu_memory = torch.cuda.get_device_properties(0).total_memory / 1024**3
 
     if gpu_memory >= 24:
-        return 48
+        batch_size = 48
     elif gpu_memory >= 16:
-        return 32
+        batch_size = 32
     elif gpu_memory >= 12:
-        return 24
+        batch_size = 24
     elif gpu_memory >= 8:
-        return 16
+        batch_size = 16
     else:
-        return 8
+        batch_size = 8
+
+    if quantized:
+        batch_size *= 2
+
+    max_batch_size = min(256, int(gpu_memory) * 8)
+
+    return min(batch_size * max(1, 256 // seq_len), max_batch_size)
 
 if __name__ == "__main__":
     input_file = "text.csv"
     output_file = "text_translated_colab.csv"
 
-    optimal_batch_size = optimize_batch_size()
-    print(f"Optimized batch size: {optimal_batch_size}")
-
-    translate_csv_batched(input_file, output_file, batch_size=optimal_batch_size)
+    translate_csv_batched(input_file, output_file)